@@ -5,11 +5,39 @@ class ExecutionMode(Enum):
     ORIGINAL_ORDER = 0
     ITERATIONS = 1
     RESULT = 2
+    ANNEALING = 3
 
     @classmethod
     def _missing_(cls, value):
-        for member in cls:
-            if member.name.lower() == value.lower():
-                return member
-        # default
-        return cls.ALL
+        # case-insensitive lookup by name. unknown values raise a ValueError
+        if isinstance(value, str):
+            return _EXECUTION_MODE_BY_LOWER_NAME.get(value.lower())
+        return None
+
+
+_EXECUTION_MODE_BY_LOWER_NAME = {member.name.lower(): member for member in ExecutionMode}
+
+LABEL_MAP = {
+    ExecutionMode.ORIGINAL_ORDER: "Original Order",
+    ExecutionMode.ITERATIONS: "Iterations",
+    ExecutionMode.RESULT: "Result",
+    ExecutionMode.ANNEALING: "Annealing",
+    "Mean": "Mean"}
+
+
+class QueryTimeRanking(Enum):
+    # MEDIAN: all timed executions, with warm runs the warm ones. COLD: first execution after cache clear.
+    # MIXED: weighted mix of both
+    MEDIAN = 0
+    COLD = 1
+    MIXED = 2
+
+    @classmethod
+    def _missing_(cls, value):
+        # case-insensitive lookup by name. unknown values raise a ValueError
+        if isinstance(value, str):
+            return _QUERY_TIME_RANKING_BY_LOWER_NAME.get(value.lower())
+        return None
+
+
+_QUERY_TIME_RANKING_BY_LOWER_NAME = {member.name.lower(): member for member in QueryTimeRanking}
@@ -1,13 +1,18 @@
 import logging
+import math
 import random
+import statistics
 import time
+from collections import OrderedDict
+from functools import lru_cache
 from itertools import chain
-from typing import List, Dict
+from typing import Callable, List, Dict, Tuple, Union
 
 from TM1py import TM1Service, Process
 
-from execution_mode import ExecutionMode
-from results import PermutationResult
+from execution_mode import ExecutionMode, QueryTimeRanking
+from permutation_cache import PermutationCache
+from results import PermutationResult, ResultContext
 
 
 def swap(order: list, i1, i2) -> List[str]:
@@ -16,16 +21,29 @@ def swap(order: list, i1, i2) -> List[str]:
     return seq
 
 
-def swap_random(order: list) -> List[str]:
-    idx = range(len(order))
-    i1, i2 = random.sample(idx, 2)
-    return swap(order, i1, i2)
+# element types don't change during the analysis. cubes sharing a dimension query it only once
+@lru_cache(maxsize=1024)
+def get_string_elements(tm1: TM1Service, dimension_name: str) -> Tuple[str, ...]:
+    if tm1.hierarchies.exists(dimension_name=dimension_name, hierarchy_name="Leaves"):
+        hierarchy_name = "Leaves"
+    else:
+        hierarchy_name = dimension_name
+
+    # filtered on the server. numeric leaves, which are usually the vast majority, are never transferred
+    return tuple(tm1.elements.get_string_element_names(
+        dimension_name=dimension_name,
+        hierarchy_name=hierarchy_name))
 
 
 class OptipyzerExecutor:
+    MAX_CACHED_PERMUTATIONS = 2048
+
     def __init__(self, tm1: TM1Service, cube_name: str, view_names: list, process_name: str,
                  displayed_dimension_order: List[str],
-                 executions: int, measure_dimension_only_numeric: bool):
+                 executions: int, measure_dimension_only_numeric: bool, warm_runs: int = None,
+                 precision_seconds: float = None, min_executions: int = 3, max_executions: int = None,
+                 permutation_cache: PermutationCache = None, abort_confidence: float = None, seed: int = None,
+                 on_result: Callable[[PermutationResult], None] = None, *, result_context: ResultContext):
         self.tm1 = tm1
         self.cube_name = cube_name
         self.view_names = view_names
@@ -36,40 +54,183 @@ class OptipyzerExecutor:
         self.mode = None
         self.include_process = bool(process_name)
         self.cube_dim_number = len(self.dimensions)
+        # None: clear the cache before every execution. Otherwise: clear once, then one cold and n warm executions
+        if warm_runs is not None and warm_runs < 1:
+            raise ValueError("'warm_runs' must be at least 1")
+        self.warm_runs = warm_runs
+        # None: fixed number of executions. Otherwise: execute until the 95% CI of the mean is narrower
+        self.precision_seconds = precision_seconds
+        self.min_executions = max(2, min_executions)
+        self.max_executions = max_executions or executions
+        # remaining executions of a view are skipped once its median exceeds the threshold
+        self.abort_threshold_by_view: Dict[str, float] = {}
+        # None: compare the median to the threshold. Otherwise: abort once mean - k * stderr exceeds the threshold
+        self.abort_confidence = abort_confidence
+        self._early_terminated_views = set()
+        self._ram_mdx = self._build_ram_usage_mdx(cube_name)
+        # results persisted by previous runs
+        self.permutation_cache = permutation_cache
+        # called once for every newly evaluated order, e.g. to write it out before the search is done
+        self.on_result = on_result
+        # own generator per executor. the seed is logged by randomized searches, so runs can be replayed
+        self.seed = random.SystemRandom().randrange(2 ** 32) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        # ids and ram baseline. executors of the same cube must share one context
+        self.result_context = result_context
+        # results of this run by dimension order, least recently used first
+        self._results_by_order: OrderedDict[Tuple[str, ...], PermutationResult] = OrderedDict()
 
     def _determine_query_permutation_result(self) -> Dict[str, List[float]]:
-        query_times_by_view = {}
-        for view_name in self.view_names:
-            query_times = []
-            for _ in range(self.executions):
+        # views are timed one after another. clearing the cache for one view must not hit a running query
+        return {
+            view_name: self._determine_view_query_times(view_name)
+            for view_name in self.view_names}
+
+    def _determine_view_query_times(self, view_name: str) -> List[float]:
+        if self.warm_runs is not None:
+            self.clear_cube_cache()
+            executions = 1 + self.warm_runs
+        else:
+            executions = self.executions
+
+        query_times = []
+        while not self._has_enough_executions(query_times, executions):
+            if self.warm_runs is None:
                 self.clear_cube_cache()
 
-                before = time.time()
-                self.tm1.cells.create_cellset_from_view(cube_name=self.cube_name, view_name=view_name, private=False)
-                query_times.append(time.time() - before)
-            query_times_by_view[view_name] = query_times
-        return query_times_by_view
+            query_times.append(self._time_query(view_name))
+
+            if self._exceeds_abort_threshold(view_name, query_times):
+                logging.info(f"Stopped executions of view '{view_name}' after {len(query_times)} runs "
+                             f"since query time exceeds {self.abort_threshold_by_view[view_name]:.5f}s")
+                self._early_terminated_views.add(view_name)
+                break
+        return query_times
+
+    def _time_query(self, view_name: str) -> float:
+        # tm1.Execute evaluates the view but only returns the cellset id. cells are never transferred
+        before = time.perf_counter()
+        cellset_id = self.tm1.cells.create_cellset_from_view(cube_name=self.cube_name, view_name=view_name, private=False)
+        query_time = time.perf_counter() - before
+
+        # cellsets would otherwise pile up on the server until the session ends
+        self.tm1.cells.delete_cellset(cellset_id)
+        return query_time
+
+    def _timed_query_times(self, query_times: List[float]) -> List[float]:
+        # the cold run is not part of the statistics if the cache is cleared only once
+        return query_times[1:] if self.warm_runs is not None else query_times
+
+    def _has_enough_executions(self, query_times: List[float], executions: int) -> bool:
+        if self.precision_seconds is None:
+            return len(query_times) >= executions
+
+        timed_query_times = self._timed_query_times(query_times)
+        if len(timed_query_times) >= self.max_executions:
+            return True
+        if len(timed_query_times) < self.min_executions:
+            return False
+        standard_error = statistics.stdev(timed_query_times) / math.sqrt(len(timed_query_times))
+        return 1.96 * standard_error < self.precision_seconds
+
+    def _exceeds_abort_threshold(self, view_name: str, query_times: List[float]) -> bool:
+        threshold = self.abort_threshold_by_view.get(view_name)
+        if threshold is None:
+            return False
+        timed_query_times = self._timed_query_times(query_times)
+        if self.abort_confidence is None:
+            return bool(timed_query_times) and statistics.median(timed_query_times) > threshold
+
+        # the view is statistically hopeless, if even the optimistic bound of its mean is slower
+        if len(timed_query_times) < 3:
+            return False
+        standard_error = statistics.stdev(timed_query_times) / math.sqrt(len(timed_query_times))
+        return statistics.fmean(timed_query_times) - self.abort_confidence * standard_error > threshold
 
     def _determine_process_permutation_result(self) -> Dict[str, List[float]]:
         execution_times = []
         for _ in range(self.executions):
             self.clear_cube_cache()
-            before = time.time()
+            before = time.perf_counter()
             try:
                 success, status, _ = self.tm1.processes.execute_with_return(process_name=self.process_name)
             except Exception as e:
                 raise e
             if not success:
                 raise RuntimeError(f"Process: '{self.process_name}' not successful; Status: '{status}'")
-            execution_times.append(time.time() - before)
+            execution_times.append(time.perf_counter() - before)
 
         return {self.process_name: execution_times}
 
     def _evaluate_permutation(self, permutation: List[str], retrieve_ram: bool = False,
                               reset_counter: bool = False, is_original_order: bool = False,
                               total_permutations=None) -> PermutationResult:
-        ram_percentage_change = self.tm1.cubes.update_storage_dimension_order(self.cube_name, permutation)
+        # original order must always be measured, since it is the baseline for ram
+        if not retrieve_ram:
+            permutation_result = self._get_cached_result(permutation)
+            if permutation_result:
+                return permutation_result
+
+        permutation_result = None
+        use_cache = self.permutation_cache is not None and not retrieve_ram
+        if use_cache:
+            permutation_result = self._load_persisted_result(permutation, total_permutations)
+
+        if not permutation_result:
+            ram_percentage_change = self.tm1.cubes.update_storage_dimension_order(self.cube_name, permutation)
+            measurements = self._measure_permutation(retrieve_ram)
+            permutation_result = self._build_permutation_result(permutation, measurements, ram_percentage_change,
+                                                                reset_counter, is_original_order, total_permutations)
+
+            if use_cache and not permutation_result.early_terminated:
+                self.permutation_cache.put(permutation_result, self._build_cache_context(), self.tm1.version)
+
+        if self.on_result:
+            self.on_result(permutation_result)
+        return permutation_result
+
+    def _build_cache_context(self) -> str:
+        # the original order is only known once it was evaluated in the shared result context
+        return PermutationCache.build_context(
+            self.view_names, self.process_name, self.executions, self.warm_runs, self.precision_seconds,
+            self.min_executions, self.max_executions, self.result_context.original_order)
+
+    def _get_cached_result(self, permutation: List[str]) -> Union[PermutationResult, None]:
+        key = tuple(permutation)
+        permutation_result = self._results_by_order.get(key)
+        if permutation_result is not None:
+            self._results_by_order.move_to_end(key)
+        return permutation_result
+
+    def _cache_result(self, permutation_result: PermutationResult):
+        key = tuple(permutation_result.dimension_order)
+        self._results_by_order[key] = permutation_result
+        self._results_by_order.move_to_end(key)
+        if len(self._results_by_order) > self.MAX_CACHED_PERMUTATIONS:
+            self._results_by_order.popitem(last=False)
+
+    def _load_persisted_result(self, permutation: List[str], total_permutations=None) -> Union[PermutationResult, None]:
+        persisted = self.permutation_cache.get(
+            self.cube_name, permutation, self._build_cache_context(), self.tm1.version)
+        if persisted is None:
+            return None
+
+        permutation_result = PermutationResult(
+            self.mode, self.cube_name, self.view_names, self.process_name, permutation,
+            persisted["query_times_by_view"], persisted["process_times_by_process"],
+            cold_query_time_by_view=persisted["cold_query_time_by_view"], ram_ratio=persisted["ram_ratio"],
+            context=self.result_context)
+        logging.info(f"Iteration {self.result_context.next_id - 2} of {total_permutations} "
+                     f"- Reused persisted result for order: {permutation} "
+                     f"- RAM [GB]: {permutation_result.ram_usage / 1024 ** 3:.2f} "
+                     f"- Query time [s]: {permutation_result.median_query_time():.5f}")
+        self._cache_result(permutation_result)
+        return permutation_result
+
+    def _measure_permutation(self, retrieve_ram: bool = False) -> Tuple[Dict, Dict, float, bool]:
+        self._early_terminated_views.clear()
         query_times_by_view = self._determine_query_permutation_result()
+        early_terminated = bool(self._early_terminated_views)
 
         process_times_by_process = None
         if self.include_process:
@@ -79,16 +240,29 @@ class OptipyzerExecutor:
         if retrieve_ram:
             ram_usage = self._retrieve_ram_usage()
 
+        return query_times_by_view, process_times_by_process, ram_usage, early_terminated
+
+    def _build_permutation_result(self, permutation: List[str], measurements: Tuple[Dict, Dict, float, bool],
+                                  ram_percentage_change: float, reset_counter: bool = False,
+                                  is_original_order: bool = False, total_permutations=None) -> PermutationResult:
+        query_times_by_view, process_times_by_process, ram_usage, early_terminated = measurements
+        cold_query_time_by_view = None
+        if self.warm_runs is not None:
+            # first execution after clearing the cache is the cold run
+            cold_query_time_by_view = {view_name: times[0] for view_name, times in query_times_by_view.items()}
+            query_times_by_view = {view_name: times[1:] for view_name, times in query_times_by_view.items()}
+
         permutation_result = PermutationResult(self.mode, self.cube_name, self.view_names, self.process_name,
                                                permutation,
                                                query_times_by_view, process_times_by_process, ram_usage,
-                                               ram_percentage_change, reset_counter)
+                                               ram_percentage_change, reset_counter, cold_query_time_by_view,
+                                               early_terminated, context=self.result_context)
 
         if is_original_order:
             progress_log = "Original Order"
         else:
             # decrease counter by 2 because log happens post increment and original order not considered as iteration
-            progress_log = f"Iteration {PermutationResult.counter - 2} of {total_permutations}"
+            progress_log = f"Iteration {self.result_context.next_id - 2} of {total_permutations}"
 
         process_log = " - No process included in test"
         if self.include_process:
@@ -99,28 +273,48 @@ class OptipyzerExecutor:
                      f"- Query time [s]: {permutation_result.median_query_time():.5f}"
                      + process_log)
 
+        self._cache_result(permutation_result)
         return permutation_result
 
-    def _retrieve_ram_usage(self):
-        number_of_iterations = 4
+    @staticmethod
+    def _build_ram_usage_mdx(cube_name: str) -> str:
+        return """
+        SELECT
+        {{ [}}PerfCubes].[{}] }} ON ROWS,
+        {{ [}}StatsStatsByCube].[Total Memory Used] }} ON COLUMNS
+        FROM [}}StatsByCube]
+        WHERE ([}}TimeIntervals].[LATEST])
+        """.format(cube_name)
+
+    def _retrieve_ram_usage(self) -> float:
+        # }StatsByCube is only filled with the next refresh of a freshly activated performance monitor.
+        # waits of 3, 6, 12 and 24s cover the same 45s as before, but return early on active monitors
+        number_of_iterations = 5
         for i in range(number_of_iterations):
-            mdx = """
-            SELECT  
-            {{ [}}PerfCubes].[{}] }} ON ROWS,
-            {{ [}}StatsStatsByCube].[Total Memory Used] }} ON COLUMNS
-            FROM [}}StatsByCube]
-            WHERE ([}}TimeIntervals].[LATEST])
-            """.format(self.cube_name)
-            value = list(self.tm1.cells.execute_mdx_values(mdx=mdx))[0]
+            value = list(self.tm1.cells.execute_mdx_values(mdx=self._ram_mdx))[0]
             if value:
                 return value
 
-            logging.info("Failed to retrieve RAM consumption. Waiting 15s before retry")
             if i < number_of_iterations - 1:
-                time.sleep(15)
+                wait = 3 * 2 ** i
+                logging.info(f"Failed to retrieve RAM consumption. Waiting {wait}s before retry")
+                time.sleep(wait)
 
         raise RuntimeError("Performance Monitor must be activated")
 
+    def _check_swap_dim_with_str_to_last_position(
+            self, dimension_name: str, target_position: int
+    ) -> bool:
+        # if a dimension has strings and target dimension is the last dimension in the cube - do not swap.
+        # rest API allows to swap a dim with string to the last position, but not out of the last position
+        string_elements = get_string_elements(self.tm1, dimension_name)
+
+        last_target_position = target_position + 1 == self.cube_dim_number
+        if string_elements and last_target_position:
+            logging.info(
+                f"Skip swapping dimension '{dimension_name}' into last position because it has string elements: {string_elements}")
+        return bool(string_elements) and last_target_position
+
     def clear_cube_cache(self):
         process = Process(name="", prolog_procedure=f"DebugUtility(125 ,0 ,0 ,'{self.cube_name}' ,'' ,'');")
         success, status, error_log_file = self.tm1.processes.execute_process_with_return(process)
@@ -132,9 +326,9 @@ class OptipyzerExecutor:
 class OriginalOrderExecutor(OptipyzerExecutor):
     def __init__(self, tm1: TM1Service, cube_name: str, view_names: List[str], process_name: str, dimensions: List[str],
                  executions: int,
-                 measure_dimension_only_numeric: bool, original_dimension_order: List[str]):
+                 measure_dimension_only_numeric: bool, original_dimension_order: List[str], **kwargs):
         super().__init__(tm1, cube_name, view_names, process_name, dimensions, executions,
-                         measure_dimension_only_numeric)
+                         measure_dimension_only_numeric, **kwargs)
         self.mode = ExecutionMode.ORIGINAL_ORDER
         self.original_dimension_order = original_dimension_order
 
@@ -150,57 +344,79 @@ class OriginalOrderExecutor(OptipyzerExecutor):
 class MainExecutor(OptipyzerExecutor):
     def __init__(self, tm1: TM1Service, cube_name: str, view_names: List[str], process_name: str, dimensions: List[str],
                  executions: int, measure_dimension_only_numeric: bool, fast: bool = False,
-                 dimensions_to_exclude: List[str] = None):
+                 dimensions_to_exclude: List[str] = None,
+                 query_time_ranking: QueryTimeRanking = QueryTimeRanking.MEDIAN,
+                 cold_weight: float = 0.5, early_termination_epsilon: float = None,
+                 baseline_result: PermutationResult = None, **kwargs):
         super().__init__(tm1, cube_name, view_names, process_name, dimensions, executions,
-                         measure_dimension_only_numeric)
+                         measure_dimension_only_numeric, **kwargs)
         self.mode = ExecutionMode.ITERATIONS
         self.fast = fast
         self.dimensions_to_exclude = (
             [] if dimensions_to_exclude is None else dimensions_to_exclude
         )
+        self.query_time_ranking = query_time_ranking
+        self.cold_weight = cold_weight
+        # stop timing a candidate once it is slower than (1 + epsilon) * query time of the committed best order
+        self.early_termination_epsilon = early_termination_epsilon
+        # already evaluated order, e.g. the original storage order. candidates with that order reuse its timings
+        self.baseline_result = baseline_result
 
         if len(view_names) > 1:
-            logging.warning("BestExecutor mode will use first view and ignore other views: " + str(view_names[1:]))
+            logging.warning("MainExecutor mode will use first view and ignore other views: " + str(view_names[1:]))
 
         self.view_name = view_names[0]
 
-    def _check_swap_dim_with_str_to_last_position(
-            self, dimension_name: str, target_position: int
-    ) -> bool:
-        # if a dimension has strings and target dimension is the last dimension in the cube - do not swap.
-        # rest API allows to swap a dim with string to the last position, but not out of the last position
-        if self.tm1.hierarchies.exists(
-                dimension_name=dimension_name, hierarchy_name="Leaves"
-        ):
-            hierarchy_name = "Leaves"
-        else:
-            hierarchy_name = dimension_name
+    def _evaluate_candidates(self, permutations: List[List[str]],
+                             total_permutations: int) -> Tuple[List[PermutationResult], List[PermutationResult]]:
+        # reuse memoized results and evaluate every other distinct order once
+        cached_results = []
+        pending = {}
+        for permutation in permutations:
+            key = tuple(permutation)
+            permutation_result = self._get_cached_result(permutation)
+            if permutation_result:
+                logging.info(f"Skipped evaluation of order: {permutation} "
+                             f"- already evaluated in iteration {permutation_result.permutation_id - 1}")
+                cached_results.append(permutation_result)
+            elif key not in pending:
+                pending[key] = permutation
+
+        # candidates share the storage order of one cube and can't be evaluated concurrently
+        new_results = [
+            self._evaluate_permutation(permutation, total_permutations=total_permutations)
+            for permutation in pending.values()]
+
+        return cached_results, new_results
+
+    def _build_schedule(self, number_of_positions: int, mid: int) -> List[int]:
+        # iteration through positions like: n, 0, n-1, 1, n-2, 2, ... until the mid-point is reached
+        schedule = []
+        for target_position in chain.from_iterable(zip(reversed(range(number_of_positions)),
+                                                       range(number_of_positions))):
+            if target_position == mid:
+                break
+            schedule.append(target_position)
 
-        elements = self.tm1.elements.get_element_types(
-            dimension_name=dimension_name,
-            hierarchy_name=hierarchy_name,
-            skip_consolidations=True,
-        )
-        string_elements = [element for element, element_type in elements.items() if element_type != "Numeric"]
-        if string_elements:
-            logging.info(
-                f"Skip swapping dimension '{dimension_name}' into last position because it has string elements: {string_elements}")
-        last_target_position = target_position + 1 == self.cube_dim_number
-        return string_elements and last_target_position
+        # fast mode only evaluates the last and the first position
+        return schedule[:2] if self.fast else schedule
 
     def execute(self) -> List[PermutationResult]:
         dimensions = self.dimensions[:]
         resulting_order = self.dimensions[:]
+        positions = {dimension: position for position, dimension in enumerate(resulting_order)}
         permutation_results = []
-        # dimensions that we're allowed to swap
-        dimension_pool = [
-            dim for dim in self.dimensions[:] if dim not in self.dimensions_to_exclude
-        ]
+        if self.baseline_result:
+            self._cache_result(self.baseline_result)
+        # dimensions that we're allowed to swap. dict serves as ordered set with O(1) removal
+        dimension_pool = dict.fromkeys(
+            dim for dim in self.dimensions if dim not in self.dimensions_to_exclude
+        )
 
         mid = int(len(dimension_pool) / 2)
 
         if not self.measure_dimension_only_numeric:
-            dimension_pool.remove(self.dimensions[-1])
+            dimension_pool.pop(self.dimensions[-1], None)
             dimensions.remove(self.dimensions[-1])
 
         if self.fast:
@@ -210,44 +426,160 @@ class MainExecutor(OptipyzerExecutor):
             # for 5 dimensional cubes we evaluate 5 + 4 + 3 + 2 permutations
             total_permutations = sum(range(2, len(dimension_pool) + 1))
 
-        # iteration through positions like: n, 0, n-1, 1, n-2, 2, ...
-        for iteration, target_position in enumerate(
-                chain(*zip(reversed(range(len(dimensions))), range(len(dimensions))))):
-            if self.fast and iteration == 2:
-                break
-
-            if target_position == mid:
-                break
-
-            results_per_dimension = list()
+        for target_position in self._build_schedule(len(dimensions), mid):
+            candidates = list()
 
             # for the current position - swap all the allowed dimensions and append all possible orders to the result set
             for dimension in dimension_pool:
-                original_position = resulting_order.index(dimension)
+                original_position = positions[dimension]
                 dimension_target = resulting_order[target_position]
 
                 if (not self._check_swap_dim_with_str_to_last_position(dimension, target_position)
                         and dimension_target in dimension_pool):
-                    permutation = list(resulting_order)
-                    permutation = swap(permutation, target_position, original_position)
-                    permutation_result = self._evaluate_permutation(permutation, total_permutations=total_permutations)
-                    permutation_results.append(permutation_result)
-                    results_per_dimension.append(permutation_result)
+                    # orders are never mutated. swapping a dimension with itself shares the current order
+                    if dimension == dimension_target:
+                        permutation = resulting_order
+                    else:
+                        permutation = swap(resulting_order, target_position, original_position)
+                    candidates.append(permutation)
+
+            cached_results, new_results = self._evaluate_candidates(candidates, total_permutations)
+            permutation_results += new_results
+            results_per_dimension = cached_results + new_results
 
             # only check for best results if any valid dim swaps are returned
             if len(results_per_dimension) > 0:
                 # for the current position - if position is higher than the mid-point - sort by ram use
                 if target_position > mid:
-                    best_order = sorted(
-                        results_per_dimension,
-                        key=lambda r: r.ram_usage)[0]
+                    best_order = min(results_per_dimension, key=lambda r: r.ram_usage)
                 # for the current position - if position is lower than the mid-point - sort by view execution time
+                # early terminated results are strictly slower than any completed result
                 else:
-                    best_order = sorted(
+                    best_order = min(
                         results_per_dimension,
-                        key=lambda r: r.median_query_time(self.view_name))[0]
+                        key=lambda r: (r.early_terminated,
+                                       r.ranking_query_time(self.view_name, self.query_time_ranking, self.cold_weight)))
+
+                if self.early_termination_epsilon is not None or self.abort_confidence is not None:
+                    self.abort_threshold_by_view = {
+                        self.view_name: (1 + (self.early_termination_epsilon or 0)) * best_order.median_query_time(
+                            self.view_name)}
+
+                resulting_order = best_order.dimension_order
+                positions = {dimension: position for position, dimension in enumerate(resulting_order)}
+                del dimension_pool[resulting_order[target_position]]
+
+        return permutation_results
+
+
+class AnnealingExecutor(OptipyzerExecutor):
+    def __init__(self, tm1: TM1Service, cube_name: str, view_names: List[str], process_name: str, dimensions: List[str],
+                 executions: int, measure_dimension_only_numeric: bool, dimensions_to_exclude: List[str] = None,
+                 max_iterations: int = None, cooling_rate: float = 0.95, max_wall_time: float = None,
+                 max_neighbor_retries: int = 8, start_result: PermutationResult = None, **kwargs):
+        super().__init__(tm1, cube_name, view_names, process_name, dimensions, executions,
+                         measure_dimension_only_numeric, **kwargs)
+        self.mode = ExecutionMode.ANNEALING
+        self.dimensions_to_exclude = (
+            [] if dimensions_to_exclude is None else dimensions_to_exclude
+        )
+        self.max_iterations = max_iterations
+        self.cooling_rate = cooling_rate
+        # seconds after which no further permutations are evaluated
+        self.max_wall_time = max_wall_time
+        # redraw neighbors that were evaluated before, instead of spending an iteration on them
+        self.max_neighbor_retries = max_neighbor_retries
+        # already evaluated order to start from, e.g. the original storage order. None: start from displayed order
+        self.start_result = start_result
+
+        if len(view_names) > 1:
+            logging.warning("AnnealingExecutor mode will use first view and ignore other views: " + str(view_names[1:]))
+
+        self.view_name = view_names[0]
+
+    def _random_neighbor(self, order: List[str], swappable_positions: List[int],
+                         max_attempts: int = 100) -> Union[List[str], None]:
+        n = len(swappable_positions)
+        for _ in range(max_attempts):
+            # two distinct positions without allocating a population for random.sample
+            j1 = self.rng.randrange(n)
+            j2 = self.rng.randrange(n - 1)
+            if j2 >= j1:
+                j2 += 1
+            i1, i2 = swappable_positions[j1], swappable_positions[j2]
+            if i2 + 1 == self.cube_dim_number:
+                i1, i2 = i2, i1
+            # rest API allows to swap a dim with string to the last position, but not out of the last position
+            if i1 + 1 == self.cube_dim_number and self._check_swap_dim_with_str_to_last_position(order[i2], i1):
+                continue
+            return swap(order, i1, i2)
+        return None
+
+    def _unevaluated_neighbor(self, order: List[str], swappable_positions: List[int]) -> Union[List[str], None]:
+        permutation = None
+        for _ in range(self.max_neighbor_retries):
+            permutation = self._random_neighbor(order, swappable_positions)
+            if permutation is None or self._get_cached_result(permutation) is None:
+                return permutation
+        # all draws were evaluated before. moving to a known order is free
+        return permutation
+
+    def execute(self) -> List[PermutationResult]:
+        start_order = list(self.start_result.dimension_order) if self.start_result else self.dimensions[:]
+        swappable_positions = [
+            position for position, dimension in enumerate(start_order)
+            if dimension not in self.dimensions_to_exclude]
+        if not self.measure_dimension_only_numeric and self.cube_dim_number - 1 in swappable_positions:
+            swappable_positions.remove(self.cube_dim_number - 1)
+
+        if len(swappable_positions) < 2:
+            logging.info(f"Not enough dimensions to swap in cube '{self.cube_name}'")
+            return []
+
+        # same budget as the greedy search in full mode: for 5 dimensional cubes 5 + 4 + 3 + 2 permutations
+        total_permutations = self.max_iterations or sum(range(2, len(swappable_positions) + 1))
+        started = time.perf_counter()
+        logging.info(f"Starting annealing for cube '{self.cube_name}' with seed {self.seed}")
+
+        # a start result costs no evaluation and is not part of the results of this executor
+        if self.start_result:
+            current_result = self.start_result
+            self._cache_result(current_result)
+            permutation_results = []
+        else:
+            current_result = self._evaluate_permutation(start_order, total_permutations=total_permutations)
+            permutation_results = [current_result]
+        current_query_time = current_result.median_query_time(self.view_name)
+        best_result, best_query_time = current_result, current_query_time
+        # energy is the query time. start at a temperature where a 10% slower order is accepted with p = 1/e
+        temperature = 0.1 * current_query_time
+        # cool down 20 times over the whole budget
+        cooling_interval = max(1, total_permutations // 20)
+
+        for iteration in range(len(permutation_results), total_permutations):
+            if self.max_wall_time is not None and time.perf_counter() - started > self.max_wall_time:
+                logging.info(f"Stopped annealing for cube '{self.cube_name}' after {self.max_wall_time}s")
+                break
+
+            permutation = self._unevaluated_neighbor(current_result.dimension_order, swappable_positions)
+            if permutation is None:
+                logging.info(f"No valid swap found for order: {current_result.dimension_order}")
+                break
+
+            candidate_result = self._get_cached_result(permutation)
+            if candidate_result is None:
+                candidate_result = self._evaluate_permutation(permutation, total_permutations=total_permutations)
+                permutation_results.append(candidate_result)
+
+            candidate_query_time = candidate_result.median_query_time(self.view_name)
+            delta = candidate_query_time - current_query_time
+            if delta <= 0 or self.rng.random() < math.exp(-delta / temperature):
+                current_result, current_query_time = candidate_result, candidate_query_time
+            if candidate_query_time < best_query_time:
+                best_result, best_query_time = candidate_result, candidate_query_time
 
-                resulting_order = list(best_order.dimension_order)
-                dimension_pool.remove(resulting_order[target_position])
+            if iteration % cooling_interval == 0:
+                temperature *= self.cooling_rate
 
+        logging.info(f"Fastest order found by annealing for cube '{self.cube_name}': {best_result.dimension_order}")
         return permutation_results
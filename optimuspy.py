@@ -4,29 +4,38 @@ import logging
 import os
 import sys
 import time
-from contextlib import suppress
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext, suppress
 from pathlib import Path
-from typing import Iterable, List, Union
+from typing import Dict, List, Tuple, Union
 
 from TM1py import TM1Service
-from mdxpy import MdxBuilder, Member, MdxHierarchySet
+from TM1py.Services import CellService
 
-from executors import ExecutionMode, OriginalOrderExecutor, MainExecutor
-from results import OptimusResult
+from execution_mode import QueryTimeRanking
+from executors import OriginalOrderExecutor, MainExecutor, AnnealingExecutor, get_string_elements
+from permutation_cache import PermutationCache
+from results import OptimusResult, PermutationResultWriter, ResultContext
 
 APP_NAME = "optimuspy"
 TIME_STAMP = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
 LOGFILE = APP_NAME + ".log"
+CACHE_FILE = APP_NAME + ".cache.sqlite"
 RESULT_PATH = Path("results/")
+ANALYSIS_VMM = "1000000"
+ANALYSIS_VMT = "1000000"
 RESULT_CSV = "{}_{}_{}_{}_{}.csv"
 RESULT_XLSX = "{}_{}_{}_{}_{}.xlsx"
 RESULT_PNG = "{}_{}_{}_{}_{}.png"
 
-LABEL_MAP = {
-    ExecutionMode.ORIGINAL_ORDER: "Original Order",
-    ExecutionMode.ITERATIONS: "Iterations",
-    ExecutionMode.RESULT: "Result",
-    "Mean": "Mean"}
+logger = logging.getLogger(APP_NAME)
+
+VMM_VMT_MDX = """
+SELECT
+{{[}}CubeProperties].[VMM],[}}CubeProperties].[VMT]}} ON 0,
+{{{}}} ON 1
+FROM [}}CubeProperties]
+"""
 
 
 def set_current_directory():
@@ -70,32 +79,21 @@ def convert_arg_to_bool(argument: Union[str, bool]):
 
 
 def is_dimension_only_numeric(tm1: TM1Service, dimension_name: str) -> bool:
-    if tm1.hierarchies.exists(dimension_name=dimension_name, hierarchy_name="Leaves"):
-        hierarchy_name = "Leaves"
-    else:
-        hierarchy_name = dimension_name
-
-    elements = tm1.elements.get_element_types(
-        dimension_name=dimension_name,
-        hierarchy_name=hierarchy_name,
-        skip_consolidations=True)
+    return not get_string_elements(tm1, dimension_name)
 
-    return all(e == "Numeric" for e in elements.values())
 
+def build_vmm_vmt_mdx(*cube_names: str):
+    members = ",".join("[}}Cubes].[{}]".format(cube_name.replace("]", "]]")) for cube_name in cube_names)
+    return VMM_VMT_MDX.format(members)
 
-def build_vmm_vmt_mdx(cube_name: str):
-    return MdxBuilder.from_cube("}CubeProperties") \
-        .add_member_tuple_to_rows(Member.of("}Cubes", cube_name)) \
-        .add_hierarchy_set_to_column_axis(
-        MdxHierarchySet.members([
-            Member.of("}CubeProperties", "VMM"),
-            Member.of("}CubeProperties", "VMT")])) \
-        .to_mdx()
 
-
-def retrieve_vmm_vmt(tm1: TM1Service, cube_name: str) -> Iterable[str]:
-    mdx = build_vmm_vmt_mdx(cube_name)
-    return tm1.cells.execute_mdx_values(mdx)
+def retrieve_vmm_vmt(tm1: TM1Service, cube_names: List[str]) -> Dict[str, Tuple[str, str]]:
+    if not cube_names:
+        return {}
+    # one cellset for all cubes. values come row by row: VMM, VMT
+    mdx = build_vmm_vmt_mdx(*cube_names)
+    values = list(tm1.cells.execute_mdx_values(mdx))
+    return {cube_name: (values[2 * i], values[2 * i + 1]) for i, cube_name in enumerate(cube_names)}
 
 
 def write_vmm_vmt(tm1: TM1Service, cube_name: str, vmm: str, vmt: str):
@@ -122,26 +120,70 @@ def deactivate_performance_monitor(tm1: TM1Service):
     tm1.server.update_static_configuration(config)
 
 
+def get_dimensions_of_cubes_with_view(tm1: TM1Service, cube_names: List[str], view_name: str) -> Dict[str, List[str]]:
+    cube_names = [cube_name for cube_name in cube_names if tm1.cubes.views.exists(cube_name, view_name, private=False)]
+    if not cube_names:
+        return {}
+    if len(cube_names) == 1:
+        return {cube_names[0]: tm1.cubes.get_dimension_names(cube_name=cube_names[0])}
+
+    # dimensions of all model cubes in one request instead of one per cube
+    cubes_with_view = set(cube_names)
+    return {
+        cube.name: [dimension for dimension in cube.dimensions if dimension != CellService.SANDBOX_DIMENSION]
+        for cube in tm1.cubes.get_model_cubes()
+        if cube.name in cubes_with_view}
+
+
 def get_cubes_to_optimize(tm1: TM1Service, cube_name: str) -> []:
     model_cubes = []
     try:
-        all_tm1_cubes = filter(lambda c: not c.startswith("}"), tm1.cubes.get_all_names())
-
         if cube_name is not None:
             if tm1.cubes.exists(cube_name = cube_name):
                 model_cubes = [cube_name]
             else:
                 raise ValueError(f"Provided cube '{cube_name}' does not exist, nothing to optimize")
         else:
-            model_cubes = all_tm1_cubes
+            model_cubes = [c for c in tm1.cubes.get_all_names() if not c.startswith("}")]
     except ValueError as e:
         print(e)
         
     return model_cubes
         
 
+def write_results(optimus_result: OptimusResult, instance_name: str, cube_name: str, view_name: str,
+                  process_name: str, output: str):
+    optimus_result.to_png(
+        view_name, process_name,
+        RESULT_PATH / RESULT_PNG.format(instance_name, cube_name, view_name, process_name, TIME_STAMP))
+
+    if output.upper() == "XLSX":
+        optimus_result.to_xlsx(
+            view_name, process_name,
+            RESULT_PATH / RESULT_XLSX.format(instance_name, cube_name, view_name, process_name, TIME_STAMP))
+
+    else:
+        if not output.upper() == "CSV":
+            logger.warning("Value for -o / --output must be 'CSV' or 'XLSX'. Default is CSV")
+        optimus_result.to_csv(
+            view_name, process_name,
+            RESULT_PATH / RESULT_CSV.format(instance_name, cube_name, view_name, process_name, TIME_STAMP))
+
+
+def log_write_error(pending_write: Future):
+    # logged as soon as the write fails, not only after the last cube
+    error = pending_write.exception()
+    if error is not None:
+        logger.error("Failed to write results: %s", error, exc_info=error)
+
+
 def main(instance_name: str, cube_name: str, view_name: str, process_name: str, executions: int, fast: bool, output: str, update: bool,
-         dimensions_to_exclude: List[str] = None, password: str = None):
+         dimensions_to_exclude: List[str] = None, password: str = None, algorithm: str = "greedy",
+         use_cache: bool = False, warm_runs: int = None, early_termination_epsilon: float = None,
+         abort_confidence: float = None, precision_seconds: float = None, query_time_ranking: str = "median",
+         cold_weight: float = 0.5, seed: int = None):
+    # fail before connecting on unknown rankings
+    query_time_ranking = QueryTimeRanking(query_time_ranking)
     config = get_tm1_config()
     tm1_args = dict(config[instance_name])
     tm1_args['session_context'] = APP_NAME
@@ -149,65 +191,101 @@ def main(instance_name: str, cube_name: str, view_name: str, process_name: str,
         tm1_args['password'] = password
         tm1_args['decode_b64'] = False
 
-    with TM1Service(**tm1_args) as tm1:
+    # a single writer thread. pyplot keeps global state and must not be used from several threads
+    with TM1Service(**tm1_args) as tm1, \
+            (PermutationCache(CACHE_FILE) if use_cache else nullcontext()) as permutation_cache, \
+            ThreadPoolExecutor(max_workers=1) as result_writer:
+        pending_writes = []
+        success = True
         original_performance_monitor_state = retrieve_performance_monitor_state(tm1)
         activate_performance_monitor(tm1)
         
         model_cubes = get_cubes_to_optimize(tm1, cube_name)
+        # metadata of all cubes is retrieved upfront instead of cube by cube
+        dimensions_by_cube = get_dimensions_of_cubes_with_view(tm1, model_cubes, view_name)
+        vmm_vmt_by_cube = retrieve_vmm_vmt(tm1, [c for c in model_cubes if c in dimensions_by_cube])
 
         for cube_name in model_cubes:
-            if not tm1.cubes.views.exists(cube_name, view_name, private=False):
-                logging.info(f"Skipping cube '{cube_name}' since view '{view_name}' does not exist")
+            if cube_name not in dimensions_by_cube:
+                logger.info("Skipping cube '%s' since view '%s' does not exist", cube_name, view_name)
                 continue
 
-            original_vmm, original_vmt = retrieve_vmm_vmt(tm1, cube_name)
-            write_vmm_vmt(tm1, cube_name, "1000000", "1000000")
+            original_vmm, original_vmt = vmm_vmt_by_cube[cube_name]
+            # cubes that already have the analysis values need neither the write nor the restore
+            vmm_vmt_changed = (str(original_vmm), str(original_vmt)) != (ANALYSIS_VMM, ANALYSIS_VMT)
+            if vmm_vmt_changed:
+                write_vmm_vmt(tm1, cube_name, ANALYSIS_VMM, ANALYSIS_VMT)
 
-            logging.info(f"Starting analysis for cube '{cube_name}'")
+            logger.info("Starting analysis for cube '%s'", cube_name)
             initial_dimension_order = tm1.cubes.get_storage_dimension_order(cube_name=cube_name)
-            logging.info(f"Original dimension order for cube '{cube_name}' is: '{initial_dimension_order}'")
-            displayed_dimension_order = tm1.cubes.get_dimension_names(cube_name=cube_name)
+            logger.info("Original dimension order for cube '%s' is: '%s'", cube_name, initial_dimension_order)
+            displayed_dimension_order = dimensions_by_cube[cube_name]
             measure_dimension_only_numeric = is_dimension_only_numeric(tm1, initial_dimension_order[-1])
 
-            permutation_results = list()
+            result_context = ResultContext()
+            # evaluated orders are collected and written as they come in, so a failed or killed run keeps them.
+            # the complete results replace the csv in the end
+            partial_results = PermutationResultWriter(
+                view_name, process_name,
+                RESULT_PATH / RESULT_CSV.format(instance_name, cube_name, view_name, process_name, TIME_STAMP))
             try:
 
                 original_order = OriginalOrderExecutor(
                     tm1, cube_name, [view_name], process_name, displayed_dimension_order, executions,
-                    measure_dimension_only_numeric, initial_dimension_order)
-                permutation_results += original_order.execute(reset_counter=True)
-
-                main_executor = MainExecutor(
-                    tm1, cube_name, [view_name], process_name, displayed_dimension_order, executions,
-                    measure_dimension_only_numeric, fast, dimensions_to_exclude)
-                permutation_results += main_executor.execute()
-
-                optimus_result = OptimusResult(cube_name, permutation_results)
+                    measure_dimension_only_numeric, initial_dimension_order, permutation_cache=permutation_cache,
+                    warm_runs=warm_runs, precision_seconds=precision_seconds, on_result=partial_results.write,
+                    result_context=result_context)
+                original_order_results = original_order.execute(reset_counter=True)
+
+                if algorithm.lower() == "annealing":
+                    # start the search from the original storage order that was just evaluated
+                    main_executor = AnnealingExecutor(
+                        tm1, cube_name, [view_name], process_name, displayed_dimension_order, executions,
+                        measure_dimension_only_numeric, dimensions_to_exclude, permutation_cache=permutation_cache,
+                        start_result=original_order_results[0], seed=seed, warm_runs=warm_runs,
+                        precision_seconds=precision_seconds, on_result=partial_results.write,
+                        result_context=result_context)
+                else:
+                    main_executor = MainExecutor(
+                        tm1, cube_name, [view_name], process_name, displayed_dimension_order, executions,
+                        measure_dimension_only_numeric, fast, dimensions_to_exclude,
+                        permutation_cache=permutation_cache, baseline_result=original_order_results[0],
+                        early_termination_epsilon=early_termination_epsilon, abort_confidence=abort_confidence,
+                        query_time_ranking=query_time_ranking, cold_weight=cold_weight,
+                        warm_runs=warm_runs, precision_seconds=precision_seconds, on_result=partial_results.write,
+                        result_context=result_context)
+                main_executor.execute()
+
+                optimus_result = OptimusResult(cube_name, partial_results.permutation_results)
 
                 best_permutation = optimus_result.best_result
-                logging.info(f"Completed analysis for cube '{cube_name}'")
+                logger.info("Completed analysis for cube '%s'", cube_name)
                 if not best_permutation:
                     tm1.cubes.update_storage_dimension_order(cube_name, initial_dimension_order)
-                    logging.info(
-                        f"No ideal dimension order found for cube '{cube_name}'."
-                        f"Restored original dimension order for cube '{cube_name}' to {initial_dimension_order}"
-                        f"Please pick manually based on csv and png results.")
+                    logger.info(
+                        "No ideal dimension order found for cube '%s'."
+                        "Restored original dimension order for cube '%s' to %s"
+                        "Please pick manually based on csv and png results.",
+                        cube_name, cube_name, initial_dimension_order)
                 else:
                     best_order = best_permutation.dimension_order
                     if update:
                         tm1.cubes.update_storage_dimension_order(cube_name, best_order)
-                        logging.info(f"Updated to best dimension order for cube '{cube_name}' to {best_order}")
+                        logger.info("Updated to best dimension order for cube '%s' to %s", cube_name, best_order)
                     else:
-                        logging.info(f"Best order for cube '{cube_name}': {best_order}")
+                        logger.info("Best order for cube '%s': %s", cube_name, best_order)
                         tm1.cubes.update_storage_dimension_order(cube_name, initial_dimension_order)
-                        logging.info(
-                            f"Restored original dimension order for cube '{cube_name}' to {initial_dimension_order}")
+                        logger.info(
+                            "Restored original dimension order for cube '%s' to %s", cube_name, initial_dimension_order)
             except Exception as e:
-                logging.error(f"Fatal error: {e}", exc_info=True)
-                return False
+                logger.error("Fatal error: %s", e, exc_info=True)
+                # results of this and previous cubes are still written and checked below
+                success = False
+                break
             finally:
-                with suppress(Exception):
-                    write_vmm_vmt(tm1, cube_name, original_vmm, original_vmt)
+                if vmm_vmt_changed:
+                    with suppress(Exception):
+                        write_vmm_vmt(tm1, cube_name, original_vmm, original_vmt)
 
                 with suppress(Exception):
                     if original_performance_monitor_state:
@@ -215,25 +293,19 @@ def main(instance_name: str, cube_name: str, view_name: str, process_name: str,
                     else:
                         deactivate_performance_monitor(tm1)
 
-                if len(permutation_results) > 0:
-                    optimus_result = OptimusResult(cube_name, permutation_results)
-                    optimus_result.to_png(
-                        view_name, process_name,
-                        RESULT_PATH / RESULT_PNG.format(instance_name, cube_name, view_name, process_name, TIME_STAMP))
+                if len(partial_results.permutation_results) > 0:
+                    # plots and files are written while the next cube is analyzed
+                    optimus_result = OptimusResult(cube_name, partial_results.permutation_results)
+                    pending_write = result_writer.submit(
+                        write_results, optimus_result, instance_name, cube_name, view_name, process_name, output)
+                    pending_write.add_done_callback(log_write_error)
+                    pending_writes.append(pending_write)
 
-                    if output.upper() == "XLSX":
-                        optimus_result.to_xlsx(
-                            view_name, process_name,
-                            RESULT_PATH / RESULT_XLSX.format(instance_name, cube_name, view_name, process_name, TIME_STAMP))
+        for pending_write in pending_writes:
+            if pending_write.exception() is not None:
+                success = False
 
-                    else:
-                        if not output.upper() == "CSV":
-                            logging.warning("Value for -o / --output must be 'CSV' or 'XLSX'. Default is CSV")
-                        optimus_result.to_csv(
-                            view_name, process_name,
-                            RESULT_PATH / RESULT_CSV.format(instance_name, cube_name, view_name, process_name, TIME_STAMP))
-
-    return True
+    return success
 
 
 if __name__ == "__main__":
@@ -292,6 +364,52 @@ if __name__ == "__main__":
                         dest="process_name",
                         help="TI Process Name",
                         default=None)
+    parser.add_argument('-a', '--algorithm',
+                        action="store",
+                        dest="algorithm",
+                        help="search algorithm: greedy or annealing",
+                        default="greedy")
+    parser.add_argument('--cache',
+                        action="store_true",
+                        dest="use_cache",
+                        help="reuse results persisted by previous runs. only if the data hasn't changed in between",
+                        default=False)
+    parser.add_argument('-w', '--warm_runs',
+                        action="store",
+                        dest="warm_runs",
+                        help="clear the cache once and time this many warm executions after the cold one",
+                        default=None)
+    parser.add_argument('--epsilon',
+                        action="store",
+                        dest="early_termination_epsilon",
+                        help="greedy only: stop timing an order once it is slower than (1 + epsilon) * best order",
+                        default=None)
+    parser.add_argument('--abort_confidence',
+                        action="store",
+                        dest="abort_confidence",
+                        help="greedy only: stop timing an order once mean - k * stderr exceeds the best order",
+                        default=None)
+    parser.add_argument('--precision',
+                        action="store",
+                        dest="precision_seconds",
+                        help="execute views until the 95%% confidence interval is narrower than this many seconds. "
+                             "-e is the maximum number of executions",
+                        default=None)
+    parser.add_argument('-r', '--ranking',
+                        action="store",
+                        dest="query_time_ranking",
+                        help="greedy only: rank query times by median, cold or mixed. cold and mixed require -w",
+                        default="median")
+    parser.add_argument('--cold_weight',
+                        action="store",
+                        dest="cold_weight",
+                        help="weight of the cold execution in the mixed ranking",
+                        default=0.5)
+    parser.add_argument('-s', '--seed',
+                        action="store",
+                        dest="seed",
+                        help="annealing only: seed of the random search. the seed of every run is logged",
+                        default=None)
 
     cmd_args = parser.parse_args()
     password = cmd_args.password
@@ -299,7 +417,7 @@ if __name__ == "__main__":
         # password must not be logged
         cmd_args.password = "*****"
 
-    logging.info(f"Starting. Arguments retrieved from cmd: {cmd_args}")
+    logger.info("Starting. Arguments retrieved from cmd: %s", cmd_args)
 
     success = main(instance_name=cmd_args.instance_name,
                    cube_name=cmd_args.cube_name,
@@ -310,9 +428,19 @@ if __name__ == "__main__":
                    output=cmd_args.output,
                    update=convert_arg_to_bool(cmd_args.update),
                    dimensions_to_exclude=str.split(cmd_args.dimensions_to_exclude, ","),
-                   password=password)
+                   password=password,
+                   algorithm=cmd_args.algorithm,
+                   use_cache=cmd_args.use_cache,
+                   warm_runs=int(cmd_args.warm_runs) if cmd_args.warm_runs else None,
+                   early_termination_epsilon=float(cmd_args.early_termination_epsilon)
+                   if cmd_args.early_termination_epsilon else None,
+                   abort_confidence=float(cmd_args.abort_confidence) if cmd_args.abort_confidence else None,
+                   precision_seconds=float(cmd_args.precision_seconds) if cmd_args.precision_seconds else None,
+                   query_time_ranking=cmd_args.query_time_ranking,
+                   cold_weight=float(cmd_args.cold_weight),
+                   seed=int(cmd_args.seed) if cmd_args.seed else None)
 
     if success:
-        logging.info("Finished successfully")
+        logger.info("Finished successfully")
     else:
         exit(1)
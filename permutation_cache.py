@@ -0,0 +1,71 @@
+import hashlib
+import json
+import sqlite3
+from typing import List, Union
+
+from results import PermutationResult
+
+
+class PermutationCache:
+    def __init__(self, cache_file: str):
+        self.connection = sqlite3.connect(cache_file)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS permutation_results (
+                cube TEXT,
+                permutation TEXT,
+                context TEXT,
+                version TEXT,
+                ram_ratio REAL,
+                query_times TEXT,
+                cold_query_times TEXT,
+                process_times TEXT,
+                PRIMARY KEY (cube, permutation, context, version))
+            """)
+
+    @staticmethod
+    def build_context(view_names: List[str], process_name: str, executions: int, warm_runs: int = None,
+                      precision_seconds: float = None, min_executions: int = None, max_executions: int = None,
+                      original_order: List[str] = None) -> str:
+        # results are only comparable if measured with the same views, process and execution protocol.
+        # ram is persisted relative to the original order, so it must be the same order as well
+        context = json.dumps([
+            view_names, process_name, executions, warm_runs, precision_seconds, min_executions, max_executions,
+            original_order])
+        return hashlib.sha1(context.encode()).hexdigest()
+
+    def get(self, cube_name: str, permutation: List[str], context: str, version: str) -> Union[dict, None]:
+        row = self.connection.execute(
+            "SELECT ram_ratio, query_times, cold_query_times, process_times FROM permutation_results "
+            "WHERE cube = ? AND permutation = ? AND context = ? AND version = ?",
+            (cube_name, json.dumps(permutation), context, version)).fetchone()
+        if row is None:
+            return None
+
+        ram_ratio, query_times, cold_query_times, process_times = row
+        return {
+            "ram_ratio": ram_ratio,
+            "query_times_by_view": json.loads(query_times),
+            "cold_query_time_by_view": json.loads(cold_query_times),
+            "process_times_by_process": json.loads(process_times)}
+
+    def put(self, permutation_result: PermutationResult, context: str, version: str):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO permutation_results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (permutation_result.cube_name,
+                 json.dumps(list(permutation_result.dimension_order)),
+                 context,
+                 version,
+                 permutation_result.ram_usage / permutation_result.original_ram,
+                 json.dumps(permutation_result.query_times_by_view),
+                 json.dumps(permutation_result.cold_query_time_by_view),
+                 json.dumps(permutation_result.process_times_by_process)))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,14 +1,17 @@
-import itertools
 import logging
 import os
 import statistics
 from pathlib import WindowsPath
-from typing import List, Union
-from execution_mode import ExecutionMode
+from typing import Dict, List, Tuple, Union
+from execution_mode import ExecutionMode, QueryTimeRanking, LABEL_MAP
 
 import seaborn as sns
 
 sns.set_theme()
+import matplotlib
+
+# plots are rendered off the main thread, which interactive backends don't support
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import pandas as pd
 
@@ -19,27 +22,49 @@ HEADER = ["ID", "Mode", "Is Best", "Mean Query Time", "Query Ratio", "Mean Proce
 PALETTE = {
     'Original Order': 'tab:blue',
     'Result': 'tab:green',
-    'Iterations': 'tab:grey'
+    'Iterations': 'tab:grey',
+    'Annealing': 'tab:orange'
 }
 
+class ResultContext:
+    # ids and ram baseline shared by the results of one cube
+    def __init__(self):
+        self.next_id = 1
+        self.current_ram = None
+        self.original_ram = None
+        self.original_order = None
+
+
 class PermutationResult:
-    counter = 1
-    current_ram = None
-    original_ram = None
+    # results are created for every evaluated order. slots avoid a __dict__ per instance
+    __slots__ = (
+        "mode", "cube_name", "view_names", "process_name", "dimension_order", "query_times_by_view",
+        "cold_query_time_by_view", "early_terminated", "process_times_by_process", "is_best", "_median_query_time",
+        "_median_process_time", "include_process", "ram_usage", "ram_percentage_change", "original_ram",
+        "ram_reduction", "permutation_id")
 
     def __init__(self, mode: str, cube_name: str, view_names: list, process_name: str, dimension_order: list,
                  query_times_by_view: dict, process_times_by_process: dict, ram_usage: float = None,
                  ram_percentage_change: float = None,
-                 reset_counter: bool = False):
-
+                 reset_counter: bool = False, cold_query_time_by_view: dict = None, early_terminated: bool = False,
+                 ram_ratio: float = None, *, context: ResultContext):
         self.mode = ExecutionMode(mode)
         self.cube_name = cube_name
         self.view_names = view_names
         self.process_name = process_name
         self.dimension_order = dimension_order
         self.query_times_by_view = query_times_by_view
+        # only set if cache was cleared once per permutation. query_times_by_view then holds the warm runs
+        self.cold_query_time_by_view = cold_query_time_by_view
+        # executions were stopped since the order was clearly slower than the best order so far
+        self.early_terminated = early_terminated
         self.process_times_by_process = process_times_by_process
         self.is_best = False
+        self._median_query_time = {
+            view_name: statistics.median(query_times) for view_name, query_times in query_times_by_view.items()}
+        self._median_process_time = {
+            process_name: statistics.median(process_times)
+            for process_name, process_times in (process_times_by_process or {}).items()}
         if process_name is None:
             self.include_process = False
         else:
@@ -48,39 +73,60 @@ class PermutationResult:
         # from original dimension order
         if ram_usage:
             self.ram_usage = ram_usage
-            PermutationResult.original_ram = ram_usage
+            context.original_ram = ram_usage
+            context.original_order = list(dimension_order)
+
+        # from persisted results. cube keeps its storage order, so current ram remains unchanged
+        elif ram_ratio is not None:
+            if context.original_ram is None:
+                raise RuntimeError("Original order must be evaluated before persisted results can be used")
+            self.ram_usage = context.original_ram * ram_ratio
 
         # from all other dimension orders
         elif ram_percentage_change is not None:
-            self.ram_usage = PermutationResult.current_ram + (
-                    PermutationResult.current_ram * ram_percentage_change / 100)
+            if context.current_ram is None:
+                raise RuntimeError("Original order must be evaluated before any other dimension order")
+            self.ram_usage = context.current_ram + (
+                    context.current_ram * ram_percentage_change / 100)
 
         else:
-            raise RuntimeError("Either 'ram_usage' or 'ram_percentage_change' must be provided")
+            raise RuntimeError("Either 'ram_usage', 'ram_ratio' or 'ram_percentage_change' must be provided")
 
-        PermutationResult.current_ram = self.ram_usage
+        if ram_ratio is None:
+            context.current_ram = self.ram_usage
         self.ram_percentage_change = ram_percentage_change or 0
 
-        self.ram_reduction = 1 - PermutationResult.current_ram / PermutationResult.original_ram
+        self.original_ram = context.original_ram
+        self.ram_reduction = 1 - self.ram_usage / self.original_ram
 
         if reset_counter:
-            PermutationResult.counter = 1
+            context.next_id = 1
 
-        self.permutation_id = PermutationResult.counter
-        PermutationResult.counter += 1
+        self.permutation_id = context.next_id
+        context.next_id += 1
 
     def median_query_time(self, view_name: str = None) -> float:
         view_name = view_name or self.view_names[0]
-        median = statistics.median(self.query_times_by_view[view_name])
+        median = self._median_query_time[view_name]
         if not median:
             raise RuntimeError(f"view '{view_name}' in cube '{self.cube_name}' is too small")
 
         return median
 
+    def ranking_query_time(self, view_name: str = None, ranking: QueryTimeRanking = QueryTimeRanking.MEDIAN,
+                           cold_weight: float = 0.5) -> float:
+        view_name = view_name or self.view_names[0]
+        if ranking == QueryTimeRanking.MEDIAN or self.cold_query_time_by_view is None:
+            return self.median_query_time(view_name)
+
+        cold_query_time = self.cold_query_time_by_view[view_name]
+        if ranking == QueryTimeRanking.COLD:
+            return cold_query_time
+        return cold_weight * cold_query_time + (1 - cold_weight) * self.median_query_time(view_name)
+
     def median_process_time(self, process_name: str = None) -> float:
         process_name = process_name or self.process_name
-        median = statistics.median(self.process_times_by_process[process_name])
-        return median
+        return self._median_process_time[process_name]
 
     def build_header(self) -> list:
         dimensions = []
@@ -93,8 +139,6 @@ class PermutationResult:
         return SEPARATOR.join(self.build_header()) + "\n"
 
     def to_row(self, view_name: str, process_name: str, original_order_result: 'PermutationResult') -> List[str]:
-        from optimuspy import LABEL_MAP
-
         median_query_time = float(self.median_query_time(view_name))
         original_median_query_time = float(original_order_result.median_query_time(view_name))
         query_time_ratio = median_query_time / original_median_query_time - 1
@@ -124,8 +168,38 @@ class PermutationResult:
         return SEPARATOR.join(row) + "\n"
 
 
+class PermutationResultWriter:
+    # appends every evaluated order to the csv right away, so a crashed or killed run keeps what it measured.
+    # the complete csv of the cube replaces the file once the analysis is done
+    def __init__(self, view_name: str, process_name: str, file_name: 'WindowsPath'):
+        self.view_name = view_name
+        self.process_name = process_name
+        self.file_name = file_name
+        self.original_order_result = None
+        self.permutation_results: List[PermutationResult] = []
+
+    def write(self, permutation_result: PermutationResult):
+        self.permutation_results.append(permutation_result)
+        lines = []
+        file_mode = "a"
+        # the original order is evaluated first and starts the file. ratios of all other orders refer to it
+        if permutation_result.mode == ExecutionMode.ORIGINAL_ORDER:
+            self.original_order_result = permutation_result
+            os.makedirs(os.path.dirname(str(self.file_name)), exist_ok=True)
+            lines.append(permutation_result.build_csv_header())
+            file_mode = "w"
+
+        lines.append(permutation_result.to_csv_row(self.view_name, self.process_name, self.original_order_result))
+        with open(str(self.file_name), file_mode) as file:
+            file.writelines(lines)
+
+
 class OptimusResult:
     TEXT_FONT_SIZE = 5
+    # above this many results only the original order and the result are labeled in the plot
+    LABEL_LIMIT = 100
+    # 8 x 8 inch plot. savefig cost grows with the pixel count
+    DPI = 200
 
     def __init__(self, cube_name: str, permutation_results: List[PermutationResult]):
 
@@ -134,6 +208,10 @@ class OptimusResult:
         if len(permutation_results) == 0:
             raise RuntimeError("Number of permutation results can not be 0")
         self.include_process = permutation_results[0].include_process
+        self.original_order_result = next(
+            (result for result in permutation_results if result.mode == ExecutionMode.ORIGINAL_ORDER), None)
+        # csv, xlsx and png of a view are written from the same frame
+        self._frame_by_view: Dict[Tuple[str, str], pd.DataFrame] = {}
 
         self.best_result = self.determine_best_result()
         if self.best_result:
@@ -143,64 +221,60 @@ class OptimusResult:
                     permutation_result.mode = ExecutionMode.RESULT
 
     def to_dataframe(self, view_name: str, process_name: str) -> pd.DataFrame:
-        header = self.permutation_results[0].build_header()
-        rows = []
-        for result in self.permutation_results:
-            rows.append(result.to_row(view_name, process_name, self.original_order_result))
-
-        return pd.DataFrame(rows, columns=header)
-
-    def to_lines(self, view_name: str, process_name: str) -> List[str]:
-        lines = itertools.chain(
-            [self.permutation_results[0].build_csv_header()],
-            [result.to_csv_row(view_name, process_name, self.original_order_result) for result in
-             self.permutation_results])
-
-        return list(lines)
+        key = (view_name, process_name)
+        if key not in self._frame_by_view:
+            header = self.permutation_results[0].build_header()
+            original_order_result = self.original_order_result
+            rows = [
+                result.to_row(view_name, process_name, original_order_result)
+                for result in self.permutation_results]
+            # object columns keep the values as built, e.g. the integer ram of the original order in the csv.
+            # only the plotted columns, which hold floats only, are converted
+            numeric_columns = ["Mean Query Time", "Query Ratio", "RAM in GB"]
+            if process_name is not None:
+                numeric_columns += ["Mean Process Time", "Process Ratio"]
+            df = pd.DataFrame(rows, columns=header, dtype=object)
+            self._frame_by_view[key] = df.astype({column: float for column in numeric_columns})
+
+        return self._frame_by_view[key]
 
     def to_csv(self, view_name: str, process_name: str, file_name: 'WindowsPath'):
-        lines = self.to_lines(view_name, process_name)
+        df = self.to_dataframe(view_name, process_name)
 
         os.makedirs(os.path.dirname(str(file_name)), exist_ok=True)
-        with open(str(file_name), "w") as file:
-            file.writelines(lines)
+        df.to_csv(str(file_name), sep=SEPARATOR, index=False)
 
     def to_xlsx(self, view_name: str, process_name: str, file_name: 'WindowsPath'):
         try:
             import xlsxwriter
 
+            df = self.to_dataframe(view_name, process_name)
+
             # Create a workbook and add a worksheet.
-            workbook = xlsxwriter.Workbook(file_name)
+            workbook = xlsxwriter.Workbook(str(file_name))
             worksheet = workbook.add_worksheet()
 
-
-            line_data = []
-
             # Set up some formats for the Header, Original order, Best result and Iterations
             header_format    = workbook.add_format({'bold': True})
             original_format  = workbook.add_format({'bg_color': '#DCE6F1'})  # Light blue = Original order
             result_format    = workbook.add_format({'bg_color': '#B3FBC1'})  # Light green = Result or Best
             iteration_format = workbook.add_format({'bg_color': '#FFFFFF'})  # White = Other Iteration
 
-            # Iterate over the data and write it out row by row.
-            for row, line in enumerate(self.to_lines(view_name, process_name)):
-
-                line_data = line.split(SEPARATOR)
-                if "Original" in line_data[1]:
+            # Write the typed values row by row, numbers stay numbers
+            worksheet.write_row(0, 0, df.columns, header_format)
+            for row, values in enumerate(df.itertuples(index=False, name=None), start=1):
+                mode = values[1]
+                if "Original" in mode:
                     row_format = original_format
-                elif "Result" in line_data[1]:
+                elif "Result" in mode:
                     row_format = result_format
-                elif row == 0:
-                    row_format = header_format
                 else:
                     row_format = iteration_format
 
-                for col, item in enumerate(line_data):
-                    worksheet.write(row, col, item, row_format)
+                worksheet.write_row(row, 0, values, row_format)
 
             # Add filters to the first row
-            if line_data:
-                worksheet.autofilter(0, 0, 0, len(line_data) - 1)
+            worksheet.autofilter(0, 0, 0, len(df.columns) - 1)
 
             workbook.close()
 
@@ -213,11 +287,12 @@ class OptimusResult:
     def to_png(self, view_name: str, process_name: str, file_name: str):
         df = self.to_dataframe(view_name, process_name)
 
-        plt.figure(figsize=(8, 8))
         sns.set_style("ticks")
+        fig, p = plt.subplots(figsize=(8, 8))
 
-        p = sns.scatterplot(
+        sns.scatterplot(
             data=df,
+            ax=p,
             x="RAM in GB",
             y="Query Ratio",
             size="Mean Process Time" if process_name is not None else None,
@@ -228,68 +303,56 @@ class OptimusResult:
             alpha=0.8,
             sizes=(20, 500) if process_name is not None else None)
 
-        for index, row in df.iterrows():
-            p.text(row["RAM in GB"],
-                   row["Query Ratio"],
-                   row["ID"],
+        # text artists dominate savefig time on large runs
+        labeled = df
+        if len(df) > self.LABEL_LIMIT:
+            labeled = df[df["Mode"].isin((LABEL_MAP[ExecutionMode.ORIGINAL_ORDER], LABEL_MAP[ExecutionMode.RESULT]))]
+
+        # plain column iteration. iterrows builds a Series per row
+        for ram_in_gb, query_ratio, permutation_id in zip(
+                labeled["RAM in GB"], labeled["Query Ratio"], labeled["ID"]):
+            p.text(ram_in_gb,
+                   query_ratio,
+                   permutation_id,
                    color='black')
 
-        sns.despine(trim=True, offset=2)
+        sns.despine(ax=p, trim=True, offset=2)
         p.set(title=f"Dimension Reorder Results for {self.cube_name}")
         p.set_xlabel("RAM (GB)")
         p.set_ylabel("Query Time Compared to Original Order")
         p.legend(title='Legend', loc='best')
 
-        plt.grid()
-        plt.tight_layout()
+        p.grid()
+        fig.tight_layout()
 
         os.makedirs(os.path.dirname(str(file_name)), exist_ok=True)
 
-        plt.savefig(file_name, dpi=400)
-        plt.clf()
-
-    @property
-    def original_order_result(self) -> PermutationResult:
-        from optimuspy import ExecutionMode
-
-        for result in self.permutation_results:
-            if result.mode == ExecutionMode.ORIGINAL_ORDER:
-                return result
+        # close the figure, clf would keep it registered with pyplot for the whole run
+        fig.savefig(file_name, dpi=self.DPI)
+        plt.close(fig)
 
     def determine_best_result(self) -> Union[PermutationResult, None]:
-        ram_range = [result.ram_usage for result in self.permutation_results]
-        min_ram, max_ram = min(ram_range), max(ram_range)
-
-        query_speed_range = [result.median_query_time() for result in self.permutation_results]
-        min_query_speed, max_query_speed = min(query_speed_range), max(query_speed_range)
-
-        if self.include_process:
-            process_speed_range = [result.median_process_time(result.process_name)
-                                   for result
-                                   in self.permutation_results]
-            min_process_execution, max_process_execution = min(process_speed_range), max(process_speed_range)
-        else:
-            min_process_execution = max_process_execution = 1
-
-            # find a good balance between speed and ram and process speed
+        # ram, query time and process time of every result, looked up once
+        metrics = [
+            (result.ram_usage,
+             result.median_query_time(),
+             result.median_process_time(result.process_name) if self.include_process else 1)
+            for result in self.permutation_results]
+        minimums = [min(values) for values in zip(*metrics)]
+        spans = [max(values) - minimum for values, minimum in zip(zip(*metrics), minimums)]
+
+        # early terminated results only have partial timings and can't be the best result
+        completed_results = [
+            (result, result_metrics)
+            for result, result_metrics in zip(self.permutation_results, metrics)
+            if not result.early_terminated]
+
+        # find a good balance between speed and ram and process speed
         for value in (0.01, 0.025, 0.05):
-            ram_threshold = min_ram + value * (max_ram - min_ram)
-            query_speed_threshold = min_query_speed + value * (max_query_speed - min_query_speed)
-
-            if self.include_process:
-                process_speed_threshold = min_process_execution + value * (
-                        max_process_execution - min_process_execution)
-                for permutation_result in self.permutation_results:
-                    if all([permutation_result.ram_usage <= ram_threshold,
-                            permutation_result.median_query_time() <= query_speed_threshold,
-                            permutation_result.median_process_time() <= process_speed_threshold]):
-                        return permutation_result
-
-            else:
-                for permutation_result in self.permutation_results:
-                    if all([permutation_result.ram_usage <= ram_threshold,
-                            permutation_result.median_query_time() <= query_speed_threshold]):
-                        return permutation_result
+            thresholds = [minimum + value * span for minimum, span in zip(minimums, spans)]
+            for permutation_result, result_metrics in completed_results:
+                if all(metric <= threshold for metric, threshold in zip(result_metrics, thresholds)):
+                    return permutation_result
 
         # no dimension order falls in sweet spot
         return None